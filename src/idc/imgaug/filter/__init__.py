@@ -15,5 +15,5 @@ from ._resize import Resize
 from ._rotate import Rotate
 from ._scale import Scale
 from ._sub_images import SubImages
-from ._sub_images_utils import (parse_regions, new_from_template, process_image, transfer_region, prune_annotations, region_filename,
+from ._sub_images_utils import (parse_regions, new_from_template, process_image, transfer_region, prune_annotations, region_filename, region_suffix, region_suffixes, overlapping_annotations, encode_image, regions_to_array,
                                 PLACEHOLDERS, REGION_SORTING, REGION_SORTING_XY, REGION_SORTING_YX, REGION_SORTING_NONE, DEFAULT_SUFFIX)
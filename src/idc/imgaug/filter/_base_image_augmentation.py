@@ -37,10 +37,28 @@ class BaseImageAugmentation(BaseFilter, abc.ABC):
         super().__init__(mode=mode, suffix=suffix, seed=seed,
                          seed_augmentation=seed_augmentation, threshold=threshold,
                          logger_name=logger_name, logging_level=logging_level)
+        self._pipeline = None
     """
     Base class for stream processors that augment images.
     """
 
+    def initialize(self):
+        """
+        Initializes the processing, e.g., for opening files or databases.
+        """
+        super().initialize()
+        self._pipeline = None
+
+    def _is_pipeline_cacheable(self) -> bool:
+        """
+        Returns whether the pipeline for unseeded augmentations can be created once and then re-used,
+        i.e., it does not depend on values sampled by the filter itself.
+
+        :return: whether the pipeline can be cached
+        :rtype: bool
+        """
+        return False
+
     def _create_pipeline(self, aug_seed):
         """
         Creates and returns the augmentation pipeline.
@@ -65,5 +83,10 @@ class BaseImageAugmentation(BaseFilter, abc.ABC):
         :return: the potentially updated image
         :rtype: ImageData
         """
-        seq = self._create_pipeline(aug_seed)
+        if (aug_seed is None) and self._is_pipeline_cacheable():
+            if self._pipeline is None:
+                self._pipeline = self._create_pipeline(None)
+            seq = self._pipeline
+        else:
+            seq = self._create_pipeline(aug_seed)
         return augment_image(item, seq, image_name=image_name)
@@ -1,5 +1,7 @@
 import argparse
-from typing import List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
 
 from seppl import Initializable, init_initializable
 from seppl.io import Filter
@@ -8,7 +10,8 @@ from wai.logging import LOGGING_WARNING
 from idc.api import ImageClassificationData, ObjectDetectionData, ImageSegmentationData, flatten_list, make_list, \
     parse_filter, merge_polygons
 from idc.imgaug.filter._sub_images_utils import REGION_SORTING_NONE, REGION_SORTING, PLACEHOLDERS, DEFAULT_SUFFIX, \
-    parse_regions, process_image, new_from_template, transfer_region, prune_annotations
+    parse_regions, process_image, new_from_template, transfer_region, prune_annotations, \
+    regions_to_array, region_suffixes
 
 
 class MetaSubImages(Filter):
@@ -20,7 +23,7 @@ class MetaSubImages(Filter):
     def __init__(self, regions: List[str] = None, region_sorting: str = REGION_SORTING_NONE,
                  include_partial: bool = False, suppress_empty: bool = False, suffix: str = DEFAULT_SUFFIX,
                  base_filter: str = None, rebuild_image: bool = False, merge_adjacent_polygons: bool = False,
-                 pad_width: int = None, pad_height: int = None,
+                 pad_width: int = None, pad_height: int = None, fast_encode: bool = False, num_workers: int = 1,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the filter.
@@ -45,6 +48,10 @@ class MetaSubImages(Filter):
         :type pad_width: int
         :param pad_height: the height to pad to, return as is if None
         :type pad_height: int
+        :param fast_encode: whether to favor encoding speed over file size for the sub-images (PNG only)
+        :type fast_encode: bool
+        :param num_workers: the number of threads to use for processing the images in parallel (1 = sequential)
+        :type num_workers: int
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
@@ -61,9 +68,15 @@ class MetaSubImages(Filter):
         self.merge_adjacent_polygons = merge_adjacent_polygons
         self.pad_width = pad_width
         self.pad_height = pad_height
+        self.fast_encode = fast_encode
+        self.num_workers = num_workers
         self._regions_xyxy = None
         self._regions_lobj = None
+        self._regions_np = None
+        self._suffixes = None
         self._base_filter = None
+        self._stats = None
+        self._executor = None
 
     def name(self) -> str:
         """
@@ -119,6 +132,8 @@ class MetaSubImages(Filter):
         parser.add_argument("-m", "--merge_adjacent_polygons", action="store_true", help="Whether to merge adjacent polygons (object detection only).", required=False)
         parser.add_argument("--pad_width", type=int, default=None, help="The width to pad the sub-images to (on the right).", required=False)
         parser.add_argument("--pad_height", type=int, default=None, help="The height to pad the sub-images to (at the bottom).", required=False)
+        parser.add_argument("--fast_encode", action="store_true", help="Whether to favor encoding speed over file size for the sub-images (PNG only).", required=False)
+        parser.add_argument("--num_workers", type=int, default=1, help="The number of threads to use for processing the images in parallel (1 = sequential); the base filter is applied sequentially in the order of the images/regions.", required=False)
         return parser
 
     def _apply_args(self, ns: argparse.Namespace):
@@ -139,6 +154,8 @@ class MetaSubImages(Filter):
         self.merge_adjacent_polygons = ns.merge_adjacent_polygons
         self.pad_width = ns.pad_width
         self.pad_height = ns.pad_height
+        self.fast_encode = ns.fast_encode
+        self.num_workers = ns.num_workers
 
     def initialize(self):
         """
@@ -161,6 +178,10 @@ class MetaSubImages(Filter):
             self.rebuild_image = False
         if self.merge_adjacent_polygons is None:
             self.merge_adjacent_polygons = False
+        if self.fast_encode is None:
+            self.fast_encode = False
+        if (self.num_workers is None) or (self.num_workers < 1):
+            self.num_workers = 1
 
         # configure base filter
         self._base_filter = parse_filter(self.base_filter)
@@ -169,6 +190,104 @@ class MetaSubImages(Filter):
             init_initializable(self._base_filter, "filter", raise_again=True)
 
         self._regions_lobj, self._regions_xyxy = parse_regions(self.regions, self.region_sorting, self.logger())
+        self._regions_np = regions_to_array(self._regions_xyxy)
+        self._suffixes = region_suffixes(self._regions_lobj, self._regions_xyxy, self.suffix)
+        self._stats = {
+            "items": 0,
+            "regions_processed": 0,
+            "regions_skipped": 0,
+            "base_filter_ns": 0,
+        }
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.num_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns statistics about the processing so far: number of items, number of regions successfully passed
+        through the base filter, number of regions skipped (e.g., empty ones or ones for which the base filter
+        returned a list) and the time spent in the base filter (nanoseconds).
+
+        :return: the statistics
+        :rtype: dict
+        """
+        if self._stats is None:
+            return dict()
+        return dict(self._stats)
+
+    def _extract(self, item):
+        """
+        Extracts the sub-images from a single record.
+
+        :param item: the record to process
+        :return: the list of tuples (located object of region, sub-image, located object of original dims),
+                 None if failed to process
+        :rtype: list
+        """
+        return process_image(item, self._regions_lobj, self._regions_xyxy, self.suffix,
+                             self.suppress_empty, self.include_partial, self.logger(),
+                             pad_width=self.pad_width, pad_height=self.pad_height,
+                             fast_encode=self.fast_encode, regions_np=self._regions_np,
+                             suffixes=self._suffixes)
+
+    def _filter(self, sub_items):
+        """
+        Passes the sub-images through the base filter, in the order of the regions.
+        Must be called from a single thread, as the base filter is not necessarily thread-safe
+        (or could be using a seeded random number generator).
+
+        :param sub_items: the list of tuples (located object of region, sub-image, located object of original dims), can be None
+        :type sub_items: list
+        :return: the list of tuples (located object of region, filtered sub-image, located object of original dims),
+                 None if no sub-images supplied
+        :rtype: list
+        """
+        stats = self._stats
+        stats["items"] += 1
+        if sub_items is None:
+            return None
+
+        logger = self.logger()
+        base_process = self._base_filter.process
+        result = []
+        for sub_region, sub_item, orig_dims in sub_items:
+            start = time.perf_counter_ns()
+            new_sub_item = base_process(sub_item)
+            stats["base_filter_ns"] += time.perf_counter_ns() - start
+            if isinstance(new_sub_item, list):
+                logger.error("Expected a single item from base filter, but received a list (#items=%d) - skipping!" % len(new_sub_item))
+                continue
+            result.append((sub_region, new_sub_item, orig_dims))
+        stats["regions_processed"] += len(result)
+        stats["regions_skipped"] += len(self._regions_xyxy) - len(result)
+        return result
+
+    def _reassemble(self, item, sub_items):
+        """
+        Reassembles the record from the filtered sub-images.
+
+        :param item: the original record
+        :param sub_items: the list of tuples (located object of region, filtered sub-image, located object of original dims), can be None
+        :type sub_items: list
+        :return: the updated record, the original one if no sub-images supplied
+        """
+        # failed to process?
+        if sub_items is None:
+            return item
+
+        rebuild_image = self.rebuild_image
+        new_item = new_from_template(item, rebuild_image=rebuild_image)
+        for sub_region, new_sub_item, orig_dims in sub_items:
+            transfer_region(new_item, new_sub_item, sub_region, rebuild_image=rebuild_image,
+                            crop_width=orig_dims.width, crop_height=orig_dims.height)
+        prune_annotations(new_item)
+        if not new_item.has_annotation():
+            self.logger().warning("No annotations attached")
+        if self.merge_adjacent_polygons and isinstance(new_item, ObjectDetectionData):
+            new_item = merge_polygons(new_item)
+        return new_item
 
     def _do_process(self, data):
         """
@@ -177,29 +296,25 @@ class MetaSubImages(Filter):
         :param data: the record(s) to process
         :return: the potentially updated record(s)
         """
-        result = []
-
-        for item in make_list(data):
-            sub_items = process_image(item, self._regions_lobj, self._regions_xyxy, self.suffix,
-                                      self.suppress_empty, self.include_partial, self.logger(),
-                                      pad_width=self.pad_width, pad_height=self.pad_height)
-            # failed to process?
-            if sub_items is None:
-                result.append(item)
-            else:
-                new_item = new_from_template(item, rebuild_image=self.rebuild_image)
-                for sub_region, sub_item, orig_dims in sub_items:
-                    new_sub_item = self._base_filter.process(sub_item)
-                    if isinstance(new_sub_item, list):
-                        self.logger().error("Expected a single item from base filter, but received a list (#items=%d) - skipping!" % len(new_sub_item))
-                        continue
-                    transfer_region(new_item, new_sub_item, sub_region, rebuild_image=self.rebuild_image,
-                                    crop_width=orig_dims.width, crop_height=orig_dims.height)
-                prune_annotations(new_item)
-                if not new_item.has_annotation():
-                    self.logger().warning("No annotations attached")
-                if self.merge_adjacent_polygons and isinstance(new_item, ObjectDetectionData):
-                    new_item = merge_polygons(new_item)
-                result.append(new_item)
+        items = make_list(data)
+        if self._executor is None:
+            result = [self._reassemble(item, self._filter(self._extract(item))) for item in items]
+        else:
+            # extracting and reassembling happens in parallel, the base filter gets applied
+            # sequentially in the order of the images/regions to keep the output reproducible
+            extracted = list(self._executor.map(self._extract, items))
+            filtered = [self._filter(sub_items) for sub_items in extracted]
+            result = list(self._executor.map(self._reassemble, items, filtered))
 
         return flatten_list(result)
+
+    def finalize(self):
+        """
+        Finishes the processing, e.g., for closing files or databases.
+        """
+        if self._stats is not None:
+            self.logger().info("stats: %s", self._stats)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        super().finalize()
@@ -1,4 +1,5 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Union
 
 import imgaug.augmenters as iaa
@@ -16,13 +17,15 @@ class Resize(Filter):
     Resizes all images according to the specified width/height. When only resizing one dimension, use 'keep-aspect-ratio' for the other one to keep the aspect ratio intact.
     """
 
-    def __init__(self, width: Union[int, str] = None, height: Union[int, str] = None,
+    def __init__(self, width: Union[int, str] = None, height: Union[int, str] = None, num_workers: int = 1,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the filter.
 
         :param width: the new width of the image
         :param height: the new height of the image
+        :param num_workers: the number of threads to use for resizing the images in parallel (1 = sequential)
+        :type num_workers: int
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
@@ -31,8 +34,11 @@ class Resize(Filter):
         super().__init__(logger_name=logger_name, logging_level=logging_level)
         self.width = width
         self.height = height
+        self.num_workers = num_workers
         self._width = None
         self._height = None
+        self._aug = None
+        self._executor = None
 
     def name(self) -> str:
         """
@@ -80,6 +86,7 @@ class Resize(Filter):
         parser = super()._create_argparser()
         parser.add_argument("-W", "--width", type=str, help="The new width for the image; use '%s' when only supplying height and you want to keep the aspect ratio intact." % KEEP_ASPECT_RATIO, default=KEEP_ASPECT_RATIO, required=False)
         parser.add_argument("-H", "--height", type=str, help="The new height for the image; use '%s' when only supplying width and you want to keep the aspect ratio intact." % KEEP_ASPECT_RATIO, default=KEEP_ASPECT_RATIO, required=False)
+        parser.add_argument("--num_workers", type=int, default=1, help="The number of threads to use for resizing the images in parallel (1 = sequential).", required=False)
         return parser
 
     def _apply_args(self, ns: argparse.Namespace):
@@ -92,6 +99,20 @@ class Resize(Filter):
         super()._apply_args(ns)
         self.width = ns.width
         self.height = ns.height
+        self.num_workers = ns.num_workers
+
+    def _parse_dimension(self, dim: Union[int, str]) -> Union[int, str]:
+        """
+        Turns the dimension into an int if possible, otherwise returns it as is.
+
+        :param dim: the dimension to parse
+        :return: the parsed dimension
+        """
+        if isinstance(dim, (int, float)):
+            return int(dim)
+        if isinstance(dim, str) and dim.strip().isdigit():
+            return int(dim)
+        return dim
 
     def initialize(self):
         """
@@ -102,15 +123,50 @@ class Resize(Filter):
             self.width = KEEP_ASPECT_RATIO
         if self.height is None:
             self.height = KEEP_ASPECT_RATIO
+        if (self.num_workers is None) or (self.num_workers < 1):
+            self.num_workers = 1
+
+        self._width = self._parse_dimension(self.width)
+        self._height = self._parse_dimension(self.height)
+        self._aug = None
+        if (self.height != KEEP_ASPECT_RATIO) or (self.width != KEEP_ASPECT_RATIO):
+            self._aug = iaa.Resize({"height": self._height, "width": self._width})
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.num_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def _needs_resize(self, item) -> bool:
+        """
+        Checks whether the image needs resizing, i.e., whether its dimensions differ from the requested ones.
 
-        try:
-            self._width = int(self.width)
-        except:
-            self._width = self.width
-        try:
-            self._height = int(self.height)
-        except:
-            self._height = self.height
+        :param item: the image to check
+        :return: True if the image needs resizing
+        :rtype: bool
+        """
+        fixed = False
+        for target, current in ((self._width, item.image_width), (self._height, item.image_height)):
+            if isinstance(target, int):
+                if target != current:
+                    return True
+                fixed = True
+            elif target != KEEP_ASPECT_RATIO:
+                return True
+        return not fixed
+
+    def _resize(self, item, aug):
+        """
+        Resizes the image if necessary.
+
+        :param item: the image to resize
+        :param aug: the resize augmenter to use
+        :return: the (potentially) resized image
+        """
+        if not self._needs_resize(item):
+            return item
+        return augment_image(item, aug)
 
     def _do_process(self, data):
         """
@@ -124,9 +180,21 @@ class Resize(Filter):
             return data
 
         result = []
-        aug = iaa.Resize({"height": self._height, "width": self._width})
-        for item in make_list(data):
-            item_new = augment_image(item, aug)
-            result.append(item_new)
+        aug = self._aug
+        if self._executor is None:
+            for item in make_list(data):
+                item_new = self._resize(item, aug)
+                result.append(item_new)
+        else:
+            result = list(self._executor.map(lambda x: self._resize(x, aug), make_list(data)))
 
         return flatten_list(result)
+
+    def finalize(self):
+        """
+        Finishes the processing, e.g., for closing files or databases.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        super().finalize()
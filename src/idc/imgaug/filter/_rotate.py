@@ -121,6 +121,16 @@ class Rotate(BaseImageAugmentation):
         """
         return (self.from_degree is not None) and (self.to_degree is not None)
 
+    def _is_pipeline_cacheable(self) -> bool:
+        """
+        Returns whether the pipeline for unseeded augmentations can be created once and then re-used,
+        i.e., it does not depend on values sampled by the filter itself.
+
+        :return: whether the pipeline can be cached
+        :rtype: bool
+        """
+        return True
+
     def _create_pipeline(self, aug_seed):
         """
         Creates and returns the augmentation pipeline.
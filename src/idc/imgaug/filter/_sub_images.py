@@ -1,4 +1,5 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from seppl.io import Filter
@@ -6,7 +7,7 @@ from wai.logging import LOGGING_WARNING
 
 from idc.api import ImageClassificationData, ObjectDetectionData, ImageSegmentationData, flatten_list, make_list
 from idc.imgaug.filter._sub_images_utils import REGION_SORTING_NONE, REGION_SORTING, PLACEHOLDERS, DEFAULT_SUFFIX, \
-    parse_regions, process_image
+    parse_regions, process_image, regions_to_array, region_suffixes
 
 
 class SubImages(Filter):
@@ -16,7 +17,7 @@ class SubImages(Filter):
 
     def __init__(self, regions: List[str] = None, region_sorting: str = REGION_SORTING_NONE,
                  include_partial: bool = False, suppress_empty: bool = False, suffix: str = DEFAULT_SUFFIX,
-                 pad_width: int = None, pad_height: int = None,
+                 pad_width: int = None, pad_height: int = None, fast_encode: bool = False, num_workers: int = 1,
                  logger_name: str = None, logging_level: str = LOGGING_WARNING):
         """
         Initializes the filter.
@@ -35,6 +36,10 @@ class SubImages(Filter):
         :type pad_width: int
         :param pad_height: the height to pad to, return as is if None
         :type pad_height: int
+        :param fast_encode: whether to favor encoding speed over file size for the sub-images (PNG only)
+        :type fast_encode: bool
+        :param num_workers: the number of threads to use for processing the images in parallel (1 = sequential)
+        :type num_workers: int
         :param logger_name: the name to use for the logger
         :type logger_name: str
         :param logging_level: the logging level to use
@@ -48,8 +53,13 @@ class SubImages(Filter):
         self.suffix = suffix
         self.pad_width = pad_width
         self.pad_height = pad_height
+        self.fast_encode = fast_encode
+        self.num_workers = num_workers
         self._regions_xyxy = None
         self._regions_lobj = None
+        self._regions_np = None
+        self._suffixes = None
+        self._executor = None
 
     def name(self) -> str:
         """
@@ -104,6 +114,8 @@ class SubImages(Filter):
             PLACEHOLDERS), required=False)
         parser.add_argument("--pad_width", type=int, default=None, help="The width to pad the sub-images to (on the right).", required=False)
         parser.add_argument("--pad_height", type=int, default=None, help="The height to pad the sub-images to (at the bottom).", required=False)
+        parser.add_argument("--fast_encode", action="store_true", help="Whether to favor encoding speed over file size for the sub-images (PNG only).", required=False)
+        parser.add_argument("--num_workers", type=int, default=1, help="The number of threads to use for processing the images in parallel (1 = sequential).", required=False)
         return parser
 
     def _apply_args(self, ns: argparse.Namespace):
@@ -121,6 +133,8 @@ class SubImages(Filter):
         self.suffix = ns.suffix
         self.pad_width = ns.pad_width
         self.pad_height = ns.pad_height
+        self.fast_encode = ns.fast_encode
+        self.num_workers = ns.num_workers
 
     def initialize(self):
         """
@@ -138,8 +152,37 @@ class SubImages(Filter):
             self.suppress_empty = False
         if self.suffix is None:
             self.suffix = DEFAULT_SUFFIX
+        if self.fast_encode is None:
+            self.fast_encode = False
+        if (self.num_workers is None) or (self.num_workers < 1):
+            self.num_workers = 1
 
         self._regions_lobj, self._regions_xyxy = parse_regions(self.regions, self.region_sorting, self.logger())
+        self._regions_np = regions_to_array(self._regions_xyxy)
+        self._suffixes = region_suffixes(self._regions_lobj, self._regions_xyxy, self.suffix)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self.num_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def _process_item(self, item) -> List:
+        """
+        Processes a single record.
+
+        :param item: the record to process
+        :return: the generated sub-images, or the record itself if it could not be processed
+        :rtype: list
+        """
+        sub_items = process_image(item, self._regions_lobj, self._regions_xyxy, self.suffix,
+                                  self.suppress_empty, self.include_partial, self.logger(),
+                                  pad_width=self.pad_width, pad_height=self.pad_height,
+                                  fast_encode=self.fast_encode, regions_np=self._regions_np,
+                                  suffixes=self._suffixes)
+        # failed to process?
+        if sub_items is None:
+            return [item]
+        return [sub_item for _, sub_item, _ in sub_items]
 
     def _do_process(self, data):
         """
@@ -150,15 +193,20 @@ class SubImages(Filter):
         """
         result = []
 
-        for item in make_list(data):
-            sub_items = process_image(item, self._regions_lobj, self._regions_xyxy, self.suffix,
-                                      self.suppress_empty, self.include_partial, self.logger(),
-                                      pad_width=self.pad_width, pad_height=self.pad_height)
-            # failed to process?
-            if sub_items is None:
-                result.append(item)
-            else:
-                for _, sub_item, _ in sub_items:
-                    result.append(sub_item)
+        if self._executor is None:
+            for item in make_list(data):
+                result.extend(self._process_item(item))
+        else:
+            for items in self._executor.map(self._process_item, make_list(data)):
+                result.extend(items)
 
         return flatten_list(result)
+
+    def finalize(self):
+        """
+        Finishes the processing, e.g., for closing files or databases.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        super().finalize()
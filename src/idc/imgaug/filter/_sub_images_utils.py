@@ -1,18 +1,11 @@
+import io
 import logging
 import os
+import re
 from typing import List, Tuple, Optional
 
 import numpy as np
-from wai.common.adams.imaging.locateobjects import LocatedObject, LocatedObjects
-from wai.common.geometry import Point as WaiPoint, Polygon as WaiPolygon
-
-from idc.api import ImageSegmentationAnnotations, ImageClassificationData, ImageSegmentationData, ObjectDetectionData, \
-    ImageData, crop_image, pad_image, fit_layers, fit_located_object, array_to_image, empty_image
-import logging
-import os
-from typing import List, Tuple, Optional
-
-import numpy as np
+from PIL import Image
 from wai.common.adams.imaging.locateobjects import LocatedObject, LocatedObjects
 from wai.common.geometry import Point as WaiPoint, Polygon as WaiPolygon
 
@@ -48,9 +41,42 @@ PLACEHOLDERS = [
     PH_Y1,
     PH_INDEX,
 ]
+PLACEHOLDERS_PATTERN = re.compile("|".join(re.escape(x) for x in PLACEHOLDERS))
 
 DEFAULT_SUFFIX = "-{INDEX}"
 
+EMPTY_LAYER_SAMPLING_STEP = 8
+
+FAST_ENCODE_OPTIONS = {
+    "PNG": {"compress_level": 1},
+}
+
+
+def encode_image(image, image_format: str, fast_encode: bool = False) -> bytes:
+    """
+    Encodes the image in the specified format.
+
+    :param image: the image to encode (PIL image or numpy array)
+    :param image_format: the format to use (PIL format name)
+    :type image_format: str
+    :param fast_encode: whether to favor encoding speed over file size (lossless formats only)
+    :type fast_encode: bool
+    :return: the encoded image
+    :rtype: bytes
+    """
+    options = None
+    if fast_encode and (image_format is not None):
+        options = FAST_ENCODE_OPTIONS.get(image_format.upper())
+    if options is None:
+        _, img_bytes = array_to_image(image, image_format)
+        return img_bytes.getvalue()
+
+    # same conversion as array_to_image, so that only the compression differs
+    image = Image.fromarray(np.uint8(image))
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format=image_format, **options)
+    return img_bytes.getvalue()
+
 
 def parse_regions(regions: List[str], region_sorting: str, logger: logging.Logger) -> Tuple[List, List]:
     """
@@ -73,27 +99,77 @@ def parse_regions(regions: List[str], region_sorting: str, logger: logging.Logge
             x, y, w, h = coords
             region_lobjs.append(LocatedObject(x=x, y=y, width=w, height=h))
 
-    logger.info("unsorted regions: %s" % str([str(x) for x in region_lobjs]))
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("unsorted regions: %s" % str([str(x) for x in region_lobjs]))
 
     if region_sorting is not REGION_SORTING_NONE:
         if region_sorting == REGION_SORTING_XY:
             def sorting(obj: LocatedObject):
-                return "%06d %06d" % (obj.x, obj.y)
+                return obj.x, obj.y
         elif region_sorting == REGION_SORTING_YX:
             def sorting(obj: LocatedObject):
-                return "%06d %06d" % (obj.y, obj.x)
+                return obj.y, obj.x
         else:
             raise Exception("Unhandled region sorting: %s" % region_sorting)
         region_lobjs.sort(key=sorting)
-        logger.info("sorted regions: %s" % str([str(x) for x in region_lobjs]))
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("sorted regions: %s" % str([str(x) for x in region_lobjs]))
 
     for lobj in region_lobjs:
         regions_xyxy.append((lobj.x, lobj.y, lobj.x + lobj.width - 1, lobj.y + lobj.height - 1))
-    logger.info("sorted xyxy: %s" % str(regions_xyxy))
+    logger.info("sorted xyxy: %s", regions_xyxy)
 
     return region_lobjs, regions_xyxy
 
 
+def region_suffix(regions_lobj: List[LocatedObject], regions_xyxy: List[Tuple], index: int, suffix_template: str) -> str:
+    """
+    Generates the suffix for the region with the specified index, filling in the placeholders.
+
+    :param regions_lobj: the regions as located objects
+    :type regions_lobj: list
+    :param regions_xyxy: the regions as xyxy tuples
+    :type regions_xyxy: list
+    :param index: the region index
+    :type index: int
+    :param suffix_template: the template to use for the suffix
+    :type suffix_template: str
+    :return: the generated suffix
+    :rtype: str
+    """
+    index_pattern = "%0" + str(len(str(len(regions_lobj)))) + "d"
+    index_str = index_pattern % index
+    values = {
+        PH_INDEX: index_str,
+        PH_X0: str(regions_xyxy[index][0]),
+        PH_Y0: str(regions_xyxy[index][1]),
+        PH_X1: str(regions_xyxy[index][2]),
+        PH_Y1: str(regions_xyxy[index][3]),
+        PH_X: str(regions_lobj[index].x),
+        PH_Y: str(regions_lobj[index].y),
+        PH_W: str(regions_lobj[index].width),
+        PH_H: str(regions_lobj[index].height),
+    }
+    return PLACEHOLDERS_PATTERN.sub(lambda m: values[m.group(0)], suffix_template)
+
+
+def region_suffixes(regions_lobj: List[LocatedObject], regions_xyxy: List[Tuple], suffix_template: str) -> List[str]:
+    """
+    Generates the suffixes for all the regions. As they only depend on the regions,
+    they can be computed once and then used for all the images.
+
+    :param regions_lobj: the regions as located objects
+    :type regions_lobj: list
+    :param regions_xyxy: the regions as xyxy tuples
+    :type regions_xyxy: list
+    :param suffix_template: the template to use for the suffix
+    :type suffix_template: str
+    :return: the list of suffixes, one per region
+    :rtype: list
+    """
+    return [region_suffix(regions_lobj, regions_xyxy, i, suffix_template) for i in range(len(regions_lobj))]
+
+
 def region_filename(path: str, regions_lobj: List[LocatedObject], regions_xyxy: List[Tuple], index: int, suffix_template: str) -> str:
     """
     Generates a new filename based on the original and the index of the region.
@@ -112,24 +188,58 @@ def region_filename(path: str, regions_lobj: List[LocatedObject], regions_xyxy:
     :rtype: str
     """
     parts = os.path.splitext(path)
-    index_pattern = "%0" + str(len(str(len(regions_lobj)))) + "d"
-    index_str = index_pattern % index
-    suffix = suffix_template
-    suffix = suffix.replace(PH_INDEX, index_str)
-    suffix = suffix.replace(PH_X0, str(regions_xyxy[index][0]))
-    suffix = suffix.replace(PH_Y0, str(regions_xyxy[index][1]))
-    suffix = suffix.replace(PH_X1, str(regions_xyxy[index][2]))
-    suffix = suffix.replace(PH_Y1, str(regions_xyxy[index][3]))
-    suffix = suffix.replace(PH_X, str(regions_lobj[index].x))
-    suffix = suffix.replace(PH_Y, str(regions_lobj[index].y))
-    suffix = suffix.replace(PH_W, str(regions_lobj[index].width))
-    suffix = suffix.replace(PH_H, str(regions_lobj[index].height))
-    return parts[0] + suffix + parts[1]
+    return parts[0] + region_suffix(regions_lobj, regions_xyxy, index, suffix_template) + parts[1]
+
+
+def regions_to_array(regions_xyxy: List[Tuple]) -> np.ndarray:
+    """
+    Turns the xyxy regions into a numpy array with the columns x0, y0, x1, y1, using
+    half-open intervals (ie x1 and y1 are exclusive), as used by overlapping_annotations.
+
+    :param regions_xyxy: the regions as list of xyxy tuples
+    :type regions_xyxy: list
+    :return: the regions as (R, 4) array
+    :rtype: np.ndarray
+    """
+    regions = np.array(regions_xyxy, dtype=np.float64).reshape((-1, 4))
+    regions[:, 2:] += 1
+    return regions
+
+
+def overlapping_annotations(annotations: LocatedObjects, regions_xyxy: List[Tuple],
+                            regions_np: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Determines which annotations (potentially) overlap with which regions, using the bounding boxes of the
+    annotations. Computed for all annotation/region pairs at once, to avoid having to compute overlap ratios for
+    annotations that are nowhere near a region. The result is a superset of the pairs for which overlap_ratio
+    returns a value larger than 0.
+
+    :param annotations: the annotations to check
+    :type annotations: LocatedObjects
+    :param regions_xyxy: the regions as list of xyxy tuples
+    :type regions_xyxy: list
+    :param regions_np: the pre-computed array of the regions (see regions_to_array), computed on the fly if None
+    :type regions_np: np.ndarray
+    :return: the boolean matrix (annotations x regions), True if the annotation overlaps the region
+    :rtype: np.ndarray
+    """
+    if (len(annotations) == 0) or (len(regions_xyxy) == 0):
+        return np.zeros((len(annotations), len(regions_xyxy)), dtype=bool)
+    # half-open intervals: [x0, x1)
+    # the boxes get widened by 1 pixel on each side, as overlap_ratio truncates the coordinates to int and
+    # widens zero width/height boxes; this ensures that no annotation gets dropped that overlap_ratio would accept
+    boxes = np.array([(o.x - 1, o.y - 1, o.x + o.width + 1, o.y + o.height + 1) for o in annotations], dtype=np.float64)
+    regions = regions_np if (regions_np is not None) else regions_to_array(regions_xyxy)
+    return ((boxes[:, None, 0] < regions[None, :, 2]) & (boxes[:, None, 2] > regions[None, :, 0])
+            & (boxes[:, None, 1] < regions[None, :, 3]) & (boxes[:, None, 3] > regions[None, :, 1]))
 
 
 def process_image(item: ImageData, regions_lobj: List[LocatedObject], regions_xyxy: List[Tuple], suffix: str,
                   suppress_empty: bool, include_partial: bool, logger: logging.Logger,
-                  pad_width: Optional[int] = None, pad_height: Optional[int] = None) -> Optional[List[Tuple[LocatedObject, ImageData, LocatedObject]]]:
+                  pad_width: Optional[int] = None, pad_height: Optional[int] = None,
+                  fast_encode: bool = False,
+                  regions_np: Optional[np.ndarray] = None,
+                  suffixes: Optional[List[str]] = None) -> Optional[List[Tuple[LocatedObject, ImageData, LocatedObject]]]:
     """
     Processes the image according to the defined regions and returns a list of tuples consisting of the located
     object for the region and the new image/annotations.
@@ -152,62 +262,100 @@ def process_image(item: ImageData, regions_lobj: List[LocatedObject], regions_xy
     :type pad_width: int
     :param pad_height: the height to pad to, return as is if None
     :type pad_height: int
+    :param fast_encode: whether to favor encoding speed over file size for the sub-images
+    :type fast_encode: bool
+    :param regions_np: the pre-computed array of the regions (see regions_to_array), computed on the fly if None
+    :type regions_np: np.ndarray
+    :param suffixes: the pre-computed suffixes for the regions (see region_suffixes), computed on the fly if None
+    :type suffixes: list
     :return: the list of tuples (located object of region, new image, located object of original dims)
     :rtype: list
     """
     result = []
-
-    pil = item.image
+    annotation = item.annotation
+    has_annotation = item.has_annotation()
+    image_name = item.image_name
+    image_format = item.image_format
+    metadata = item.get_metadata()
+    name_parts = os.path.splitext(image_name)
+    if suffixes is None:
+        suffixes = region_suffixes(regions_lobj, regions_xyxy, suffix)
+
+    # determine which annotations overlap which regions
+    overlaps = None
+    if isinstance(item, ObjectDetectionData) and has_annotation:
+        overlaps = overlapping_annotations(annotation, regions_xyxy, regions_np=regions_np)
+
+    # clip the regions to the image dimensions
+    width = item.image_width
+    height = item.image_height
+    regions_clipped = [(x0, y0, min(x1, width - 1), min(y1, height - 1)) for x0, y0, x1, y1 in regions_xyxy]
+
+    pil = None
     for region_index, region_xyxy in enumerate(regions_xyxy):
-        logger.info("Applying region %d :%s" % (region_index, str(region_xyxy)))
+        logger.info("Applying region %d :%s", region_index, region_xyxy)
 
-        # crop image
-        x0, y0, x1, y1 = region_xyxy
-        if x1 >= item.image_width:
-            x1 = item.image_width - 1
-        if y1 >= item.image_height:
-            y1 = item.image_height - 1
-        sub_image = pil.crop((x0, y0, x1+1, y1+1))
-        orig_dims = LocatedObject(0, 0, sub_image.size[0], sub_image.size[1])
-        sub_image = pad_image(sub_image, pad_width=pad_width, pad_height=pad_height)
-        _, sub_bytes = array_to_image(sub_image, item.image_format)
-        image_name_new = region_filename(item.image_name, regions_lobj, regions_xyxy, region_index, suffix)
-
-        # crop annotations and forward
+        # crop annotations first, so that empty regions can be skipped before cropping/encoding the image
         region_lobj = regions_lobj[region_index]
         if isinstance(item, ImageClassificationData):
-            annotation = item.annotation
-            if not suppress_empty or (annotation is not None):
-                item_new = ImageClassificationData(image_name=image_name_new, data=sub_bytes.getvalue(),
-                                                   annotation=annotation, metadata=item.get_metadata())
-                result.append((region_lobj, item_new, orig_dims))
+            data_cls = ImageClassificationData
+            new_annotation = annotation
+            if suppress_empty and (new_annotation is None):
+                continue
         elif isinstance(item, ObjectDetectionData):
+            data_cls = ObjectDetectionData
             new_objects = []
-            if item.has_annotation():
-                for ann_lobj in item.annotation:
+            if overlaps is not None:
+                for ann_index in np.flatnonzero(overlaps[:, region_index]):
+                    ann_lobj = annotation[ann_index]
                     ratio = region_lobj.overlap_ratio(ann_lobj)
                     if ((ratio > 0) and include_partial) or (ratio >= 1):
                         new_objects.append(fit_located_object(region_index, region_lobj, ann_lobj, logger))
-            if not suppress_empty or (len(new_objects) > 0):
-                item_new = ObjectDetectionData(image_name=image_name_new, data=sub_bytes.getvalue(),
-                                               annotation=LocatedObjects(new_objects), metadata=item.get_metadata())
-                result.append((region_lobj, item_new, orig_dims))
+            if suppress_empty and (len(new_objects) == 0):
+                continue
+            new_annotation = LocatedObjects(new_objects)
         elif isinstance(item, ImageSegmentationData):
-            new_annotations = ImageSegmentationAnnotations(list(), dict())
-            if item.has_annotation():
-                new_annotations = fit_layers(region_lobj, item.annotation, suppress_empty)
-            if not suppress_empty or (len(new_annotations.layers) > 0):
-                for label in new_annotations.layers:
-                    new_annotations.layers[label] = pad_image(new_annotations.layers[label], pad_width=pad_width, pad_height=pad_height)
-                if len(new_annotations.layers) == 0:
-                    new_annotations = None
-                item_new = ImageSegmentationData(image_name=image_name_new, data=sub_bytes.getvalue(),
-                                                 annotation=new_annotations, metadata=item.get_metadata())
-                result.append((region_lobj, item_new, orig_dims))
+            data_cls = ImageSegmentationData
+            new_annotation = ImageSegmentationAnnotations(list(), dict())
+            if has_annotation:
+                new_annotation = fit_layers(region_lobj, annotation, suppress_empty)
+            if suppress_empty and (len(new_annotation.layers) == 0):
+                continue
+            for label in new_annotation.layers:
+                new_annotation.layers[label] = pad_image(new_annotation.layers[label], pad_width=pad_width, pad_height=pad_height)
+            if len(new_annotation.layers) == 0:
+                new_annotation = None
         else:
             logger.warning("Unhandled data (%s), skipping!" % str(type(item)))
             return None
 
+        # crop image
+        x0, y0, x1, y1 = regions_clipped[region_index]
+        if (x0 == 0) and (y0 == 0) and (x1 == width - 1) and (y1 == height - 1) \
+                and (pad_width is None) and (pad_height is None):
+            # region covers the full image, no need to crop/re-encode
+            # (image_bytes would decode and re-encode the image, so use the raw data if available)
+            orig_dims = LocatedObject(0, 0, width, height)
+            if item.data is not None:
+                sub_data = item.data
+            else:
+                if pil is None:
+                    pil = item.image
+                sub_data = encode_image(pil, image_format, fast_encode=fast_encode)
+        else:
+            if pil is None:
+                pil = item.image
+            sub_image = pil.crop((x0, y0, x1+1, y1+1))
+            orig_dims = LocatedObject(0, 0, sub_image.size[0], sub_image.size[1])
+            sub_image = pad_image(sub_image, pad_width=pad_width, pad_height=pad_height)
+            sub_data = encode_image(sub_image, image_format, fast_encode=fast_encode)
+        image_name_new = name_parts[0] + suffixes[region_index] + name_parts[1]
+
+        # forward
+        item_new = data_cls(image_name=image_name_new, data=sub_data,
+                            annotation=new_annotation, metadata=metadata)
+        result.append((region_lobj, item_new, orig_dims))
+
     return result
 
 
@@ -348,8 +496,10 @@ def prune_annotations(image):
         # check which layers are empty
         empty = []
         for label in image.annotation.layers:
-            unique = np.unique(image.annotation.layers[label])
-            if (len(unique) == 1) and (unique[0] == 0):
+            layer = image.annotation.layers[label]
+            # any() avoids sorting the layer like np.unique, but still scans the whole layer;
+            # checking a strided sample first is an early out for layers with larger objects
+            if not (layer[::EMPTY_LAYER_SAMPLING_STEP, ::EMPTY_LAYER_SAMPLING_STEP].any() or layer.any()):
                 empty.append(label)
 
         # remove empty layers
@@ -117,6 +117,17 @@ def generate(width: int, height: int,
         _logger.info("#rows: %d" % num_rows)
         _logger.info("#cols: %d" % num_cols)
         _logger.info("fixed width/height: %s" % str(fixed_size))
+        # the columns are the same for every row
+        cols = []
+        for col in range(num_cols):
+            x = col * section_width // num_cols + margin_left
+            if (col == num_cols - 1) and not fixed_size:
+                w = section_width - x
+            else:
+                w = section_width // num_cols
+            if col < num_cols - 1:
+                w += overlap_right
+            cols.append((x, w))
         for row in range(num_rows):
             y = row * section_height // num_rows + margin_top
             if (row == num_rows - 1) and not fixed_size:
@@ -125,15 +136,7 @@ def generate(width: int, height: int,
                 h = section_height // num_rows
             if row < num_rows - 1:
                 h += overlap_bottom
-            for col in range(num_cols):
-                x = col * section_width // num_cols + margin_left
-                if (col == num_cols - 1) and not fixed_size:
-                    w = section_width - x
-                else:
-                    w = section_width // num_cols
-                if col < num_cols - 1:
-                    w += overlap_right
-                result.append(Region(x=x, y=y, w=w, h=h))
+            result.extend(Region(x=x, y=y, w=w, h=h) for x, w in cols)
 
     # fixed row/col size
     elif mode == "size":